@@ -1,4 +1,8 @@
 import os
+import sqlite3
+import time
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 from flask import (
@@ -10,6 +14,8 @@ from flask import (
     flash,
 )
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
 from flask_login import (
     LoginManager,
     login_user,
@@ -18,8 +24,13 @@ from flask_login import (
     current_user,
     UserMixin,
 )
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 # -----------------------------------------
@@ -39,13 +50,37 @@ DATABASE_URL = _normalize_db_url(
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-change-me")
 
+# Argon2id with a fixed, benchmarked cost (OWASP minimum: 19 MiB, t=2, p=1)
+PASSWORD_HASHER = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
 app = Flask(__name__)
 app.config["SECRET_KEY"] = SECRET_KEY
 app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+if DATABASE_URL.startswith("postgresql"):
+    # Render drops idle connections; pre-ping/recycle instead of failing the
+    # first request after a quiet spell.
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_pre_ping": True,
+        "pool_recycle": 300,
+    }
 
 db = SQLAlchemy(app)
 
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Local SQLite: WAL so reads don't block on writes, and wait on locks."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 
@@ -71,14 +106,38 @@ class User(UserMixin, db.Model):
     tasks = db.relationship("Task", backref="user", lazy=True)
 
     def set_password(self, password: str):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = PASSWORD_HASHER.hash(password)
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
+        """
+        Verify a password. On success, rehashes in place if the stored hash
+        is an old werkzeug one or uses outdated argon2 params; the caller
+        commits.
+        """
+        if not self.password_hash.startswith("$argon2"):
+            if not check_password_hash(self.password_hash, password):
+                return False
+            self.set_password(password)
+            return True
+
+        try:
+            PASSWORD_HASHER.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+        if PASSWORD_HASHER.check_needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
 
 class Task(db.Model):
     __tablename__ = "tasks"
+    # Serves the pending list for Discord (user_id, done=false, order by id)
+    # straight from the index; index() still sorts, since it spans both done
+    # values and orders by id alone.
+    __table_args__ = (
+        db.Index("ix_tasks_user_done_id", "user_id", "done", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
@@ -102,36 +161,151 @@ def load_user(user_id):
 # DISCORD
 # -----------------------------------------
 
-def build_embed_for_user(user, tasks):
-    """Build a Discord embed for a single user's tasks."""
-    pending = [t for t in tasks if not t.done]
+# Shared keep-alive pool so webhook posts reuse TLS connections to discord.com.
+# Discord rate-limits webhooks often, so retry 429 and gateway errors (honours
+# Retry-After). Only failures where Discord never took the message are retried;
+# read errors/timeouts are not, or a lost reply would post the message twice.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            read=0,
+            backoff_factor=0.3,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        ),
+    ),
+)
+
+# Webhook posts run here so neither cron nor a request thread waits on Discord
+SEND_WORKERS = 16
+_SEND_POOL = ThreadPoolExecutor(max_workers=SEND_WORKERS)
+
+
+# Discord embed limits; a message over any of these is rejected with a 400
+EMBED_MAX_FIELDS = 25
+EMBEDS_PER_MESSAGE = 10
+MESSAGE_MAX_CHARS = 6000
+TITLE_MAX = 256
+FIELD_NAME_MAX = 256
+FIELD_VALUE_MAX = 1024
+
+EMBED_COLOR = 0x00FF99
+
+# Embeds always have the same shape, so only the variable parts get encoded.
+# The first embed carries the description, continuations leave the key out.
+# The last slot is the optional ',"fields":[...]' member (omitted when empty).
+_FIRST_EMBED_TEMPLATE = (
+    b'{"title":%b,"description":%b,"color":%d,"timestamp":"%b"%b}'
+)
+_EMBED_TEMPLATE = b'{"title":%b,"color":%d,"timestamp":"%b"%b}'
+
+
+def _chunk_fields(title, desc, fields):
+    """
+    Split embed fields into messages (lists of embeds, each a list of fields)
+    within Discord's limits: 25 fields per embed, and 10 embeds / 6000 chars
+    per message. Only the first embed carries the description.
+    """
+    messages = [[[]]]
+    chars = len(title) + len(desc)
+
+    for field in fields:
+        embeds = messages[-1]
+        needs_embed = len(embeds[-1]) >= EMBED_MAX_FIELDS
+        size = len(field["name"]) + len(field["value"])
+        if needs_embed:
+            size += len(title)
+
+        if chars + size > MESSAGE_MAX_CHARS or (
+            needs_embed and len(embeds) >= EMBEDS_PER_MESSAGE
+        ):
+            embeds = []
+            messages.append(embeds)
+            needs_embed = True
+            chars = len(title) + len(field["name"]) + len(field["value"])
+        else:
+            chars += size
+
+        if needs_embed:
+            embeds.append([])
+        embeds[-1].append(field)
+
+    return messages
+
+
+def _pending_tasks(user: User):
+    return (
+        Task.query.filter_by(user_id=user.id, done=False)
+        .order_by(Task.id)
+        .all()
+    )
+
+
+def build_payloads_for_user(user: User, pending) -> list:
+    """
+    Encode the webhook bodies (one per message) for a user's pending tasks
+    (already filtered in SQL).
+    """
     if pending:
         desc = f"You have **{len(pending)}** pending task(s)."
     else:
         desc = "No pending tasks 🎉"
 
-    fields = []
-    for t in pending:
-        note = t.note or "No extra info"
-        fields.append(
-            {
-                "name": f"{t.id}. {t.title}",
-                "value": note,
-                "inline": False,
-            }
-        )
-
-    embed = {
-        "title": f"📝 Tasks for {user.email}",
-        "description": desc,
-        "color": 0x00FF99,
-        "timestamp": datetime.utcnow().isoformat() + "Z",
-    }
-
-    if fields:
-        embed["fields"] = fields
-
-    return embed
+    title = f"📝 Tasks for {user.email}"[:TITLE_MAX]
+    fields = [
+        {
+            "name": ("%d. %s" % (t.id, t.title))[:FIELD_NAME_MAX],
+            "value": (t.note or "No extra info")[:FIELD_VALUE_MAX],
+            "inline": False,
+        }
+        for t in pending
+    ]
+
+    title_b = orjson.dumps(title)
+    desc_b = orjson.dumps(desc)
+    timestamp_b = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()).encode()
+
+    payloads = []
+    for message in _chunk_fields(title, desc, fields):
+        embeds = []
+        for embed_fields in message:
+            fields_b = (
+                b',"fields":' + orjson.dumps(embed_fields) if embed_fields else b""
+            )
+            if not payloads and not embeds:
+                embed = _FIRST_EMBED_TEMPLATE % (
+                    title_b, desc_b, EMBED_COLOR, timestamp_b, fields_b
+                )
+            else:
+                embed = _EMBED_TEMPLATE % (
+                    title_b, EMBED_COLOR, timestamp_b, fields_b
+                )
+            embeds.append(embed)
+        payloads.append(b'{"embeds":[' + b",".join(embeds) + b"]}")
+    return payloads
+
+
+def post_to_discord(email: str, webhook_url: str, payloads: list):
+    """POST encoded payloads to a webhook, in order. Only does HTTP, safe to thread."""
+    try:
+        for payload in payloads:
+            resp = _SESSION.post(
+                webhook_url,
+                data=payload,
+                headers={"Content-Type": "application/json"},
+                timeout=10,
+            )
+            print(f"[{email}] Discord status:", resp.status_code)
+            print(f"[{email}] Discord response:", resp.text)
+            resp.raise_for_status()
+    except Exception as e:
+        print(f"Error sending to Discord for {email}:", repr(e))
 
 
 def send_to_discord_for_user(user: User):
@@ -141,27 +315,15 @@ def send_to_discord_for_user(user: User):
         print(f"User {user.email} has no webhook set, skipping.")
         return
 
-    with app.app_context():
-        tasks = (
-            Task.query.filter_by(user_id=user.id, done=False)
-            .order_by(Task.id)
-            .all()
-        )
+    with app.app_context(), db.session.no_autoflush:
+        tasks = _pending_tasks(user)
 
     if not tasks:
         print(f"User {user.email} has no pending tasks, skipping.")
         return
 
-    embed = build_embed_for_user(user, tasks)
-    payload = {"embeds": [embed]}
-
-    try:
-        resp = requests.post(webhook_url, json=payload, timeout=10)
-        print(f"[{user.email}] Discord status:", resp.status_code)
-        print(f"[{user.email}] Discord response:", resp.text)
-        resp.raise_for_status()
-    except Exception as e:
-        print(f"Error sending to Discord for {user.email}:", repr(e))
+    payloads = build_payloads_for_user(user, tasks)
+    _SEND_POOL.submit(post_to_discord, user.email, webhook_url, payloads)
 
 
 def should_ping_user(user: User, now: datetime) -> bool:
@@ -186,17 +348,70 @@ def should_ping_user(user: User, now: datetime) -> bool:
     return (now - user.last_ping_at) >= timedelta(hours=interval)
 
 
+def _due_users_with_tasks_query(now: datetime):
+    """
+    Due users joined to their pending tasks, one (user, task) row each
+    (task is None when a user has nothing pending).
+
+    SQL version of should_ping_user, so cron only loads users it may ping.
+    The interval check needs make_interval, so it's only pushed down on
+    Postgres; elsewhere should_ping_user still does the final check.
+    """
+    query = (
+        db.session.query(User, Task)
+        .outerjoin(
+            Task,
+            db.and_(Task.user_id == User.id, Task.done == db.false()),
+        )
+        .filter(
+            User.webhook_url.isnot(None),
+            User.webhook_url != "",
+            User.ping_interval_hours > 0,
+        )
+    )
+    if db.engine.dialect.name == "postgresql":
+        query = query.filter(
+            db.or_(
+                User.last_ping_at.is_(None),
+                User.last_ping_at
+                <= now - func.make_interval(0, 0, 0, 0, User.ping_interval_hours),
+            )
+        )
+    # Lock the user rows so overlapping cron runs don't both claim the same
+    # user (tasks are on the nullable side of the join, so can't be locked).
+    # The caller commits last_ping_at before posting, releasing the locks.
+    return query.order_by(User.id, Task.id).with_for_update(
+        of=User, skip_locked=True
+    )
+
+
 def send_to_discord_all_users():
     """Cron mode: send for all users who are due based on their interval."""
     now = datetime.utcnow()
     with app.app_context():
-        users = User.query.all()
-        for user in users:
-            if should_ping_user(user, now):
-                send_to_discord_for_user(user)
-                user.last_ping_at = now  # update last ping time
+        with db.session.no_autoflush:
+            rows = _due_users_with_tasks_query(now).all()
+
+        # DB work stays on this thread; only the HTTP posts fan out.
+        jobs = []
+        for user, group in groupby(rows, key=lambda row: row[0]):
+            if not should_ping_user(user, now):
+                continue
+            tasks = [task for _, task in group if task is not None]
+            if tasks:
+                payloads = build_payloads_for_user(user, tasks)
+                jobs.append((user.email, user.webhook_url, payloads))
+            else:
+                print(f"User {user.email} has no pending tasks, skipping.")
+            user.last_ping_at = now  # update last ping time
+
+        # Claim the users and release the row locks before any HTTP, so slow
+        # webhooks don't block settings/login writes. A concurrent cron run
+        # now sees the new last_ping_at and skips them.
         db.session.commit()
 
+        list(_SEND_POOL.map(lambda job: post_to_discord(*job), jobs))
+
 
 # -----------------------------------------
 # ROUTES: AUTH
@@ -250,6 +465,7 @@ def login():
             flash("Invalid email or password.", "error")
             return redirect(url_for("login"))
 
+        db.session.commit()  # persist a rehashed password, if any
         login_user(user)
         flash("Logged in successfully.", "success")
         return redirect(url_for("index"))
@@ -303,11 +519,13 @@ def settings():
 @app.route("/")
 @login_required
 def index():
-    tasks = (
-        Task.query.filter_by(user_id=current_user.id)
-        .order_by(Task.id.desc())
-        .all()
-    )
+    # Read-only; skip the autoflush dirty check before the SELECT
+    with db.session.no_autoflush:
+        tasks = (
+            Task.query.filter_by(user_id=current_user.id)
+            .order_by(Task.id.desc())
+            .all()
+        )
     return render_template("index.html", tasks=tasks)
 
 
@@ -332,23 +550,54 @@ def add_task():
 @app.route("/done/<int:task_id>", methods=["POST"])
 @login_required
 def mark_done(task_id):
-    task = Task.query.filter_by(id=task_id, user_id=current_user.id).first()
-    if not task:
+    # Single UPDATE; no need to SELECT the row first
+    updated = (
+        Task.query.filter_by(id=task_id, user_id=current_user.id)
+        .update({"done": True}, synchronize_session=False)
+    )
+    db.session.commit()
+    if not updated:
         flash("Task not found.", "error")
         return redirect(url_for("index"))
 
-    task.done = True
-    db.session.commit()
     flash("Task marked as done.", "success")
     return redirect(url_for("index"))
 
 
+@app.route("/done", methods=["POST"])
+@login_required
+def bulk_done():
+    task_ids = []
+    for raw in request.form.getlist("task_id"):
+        try:
+            task_ids.append(int(raw))
+        except ValueError:
+            continue
+
+    if not task_ids:
+        flash("No tasks selected.", "error")
+        return redirect(url_for("index"))
+
+    # One UPDATE for the whole selection instead of a round trip per task
+    updated = (
+        Task.query.filter(
+            Task.user_id == current_user.id,
+            Task.id.in_(task_ids),
+            Task.done == db.false(),
+        )
+        .update({"done": True}, synchronize_session=False)
+    )
+    db.session.commit()
+    flash(f"Marked {updated} task(s) as done.", "success")
+    return redirect(url_for("index"))
+
+
 @app.route("/send", methods=["POST"])
 @login_required
 def send_now():
     # Manual send: ignore schedule; just send for this user
     send_to_discord_for_user(current_user)
-    flash("Tasks sent to your Discord webhook (if set).", "success")
+    flash("Sending tasks to your Discord webhook (if set).", "success")
     return redirect(url_for("index"))
 
 
@@ -360,6 +609,9 @@ def send_now():
 def init_db():
     """One-time route to create tables. Hit once after deploying/migrating."""
     db.create_all()
+    # create_all skips tables that already exist, so add any new indexes too
+    for index in Task.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
     return "Database tables created."
 
 
@@ -381,4 +633,5 @@ if __name__ == "__main__":
     if args.send:
         send_to_discord_all_users()
     else:
-        app.run(debug=True)
+        # Local dev only; production runs under gunicorn (see Procfile / wsgi.py)
+        app.run(debug=os.environ.get("FLASK_DEBUG") == "1")